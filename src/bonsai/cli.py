@@ -5,14 +5,27 @@ Command line interface for Bonsai
 """
 
 import argparse
+import os
+import stat
 import sys
 import json
-from pathlib import Path
+from typing import TextIO
 
 from .config import Config
 from .processor import TreeProcessor
 
 
+def _positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 def create_parser() -> argparse.ArgumentParser:
     """Create command line argument parser"""
     parser = argparse.ArgumentParser(
@@ -87,6 +100,15 @@ Examples:
         help="Force include patterns (can be used multiple times)"
     )
     
+    parser.add_argument(
+        "--jobs", "-j",
+        type=_positive_int,
+        default=1,
+        metavar="N",
+        help="Threads listing top-level directories, at most one per directory; "
+             "must be at least 1 (default: 1, a single-threaded walk)"
+    )
+    
     # Output options
     parser.add_argument(
         "--output", "-o",
@@ -110,18 +132,29 @@ Examples:
     return parser
 
 
+def write_output(processor: TreeProcessor, output_format: str, fp: TextIO) -> None:
+    """Write processor output in the given format to fp"""
+    if output_format == "json":
+        # Encode in one go and write once
+        fp.write(json.dumps(processor.generate_json(), indent=2))
+        fp.write("\n")
+    else:
+        processor.write_tree(fp)
+
+
 def cli():
     """Main entry point for the CLI"""
     parser = create_parser()
     args = parser.parse_args()
     
-    # Validate path
-    path = Path(args.path)
-    if not path.exists():
+    # Validate path; one stat answers both checks
+    try:
+        path_stat = os.stat(args.path)
+    except OSError:
         print(f"Error: Path '{args.path}' does not exist", file=sys.stderr)
         sys.exit(1)
     
-    if not path.is_dir():
+    if not stat.S_ISDIR(path_stat.st_mode):
         print(f"Error: Path '{args.path}' is not a directory", file=sys.stderr)
         sys.exit(1)
     
@@ -132,19 +165,13 @@ def cli():
     processor = TreeProcessor(config)
     
     try:
-        # Generate output
-        if args.format == "json":
-            output = json.dumps(processor.generate_json(), indent=2)
-        else:
-            output = "\n".join(processor.generate_tree())
-        
-        # Write output
+        # Write output as it is generated
         if args.output:
             with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(output)
+                write_output(processor, args.format, f)
             print(f"Output written to {args.output}")
         else:
-            print(output)
+            write_output(processor, args.format, sys.stdout)
     
     except KeyboardInterrupt:
         print("\nInterrupted by user", file=sys.stderr)
@@ -8,7 +8,7 @@ from pathlib import Path
 from typing import Optional, List
 
 
-@dataclass
+@dataclass(slots=True)
 class Config:
     """Configuration settings for Bonsai"""
     
@@ -31,6 +31,9 @@ class Config:
     output_file: Optional[str] = None
     output_format: str = "tree"  # tree, json, yaml
     
+    # Traversal settings
+    jobs: int = 1
+    
     @classmethod
     def from_args(cls, args):
         """Create config from command line arguments"""
@@ -46,6 +49,7 @@ class Config:
             force_include_patterns=args.include or [],
             output_file=args.output,
             output_format=args.format,
+            jobs=args.jobs,
         )
     
     def get_root_path(self) -> Path:
@@ -3,29 +3,147 @@
 Main processing logic for Bonsai
 """
 
+import os
+import stat
+import threading
 from pathlib import Path
-from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Set, TextIO, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 from .config import Config
 from .utils import (
-    find_gitignore_files, parse_gitignore, matches_pattern,
-    get_file_size, format_file_size, get_file_icon, colorize_output
+    find_gitignore_files, parse_gitignore, PatternMatcher,
+    format_file_size, get_file_icon, COLORS, RESET
 )
 
 
-@dataclass
+# Whether directories can be listed through an open fd, so DirEntry.stat()
+# is an fstatat() relative to it
+_SCANDIR_FD = os.scandir in os.supports_fd and hasattr(os, 'O_DIRECTORY')
+_DIR_OPEN_FLAGS = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+
+# Upper bound on threads used to read .gitignore files
+_GITIGNORE_READ_WORKERS = 8
+
+# Tree drawing pieces
+_MID_BRANCH = "├── "
+_LAST_BRANCH = "└── "
+_VERTICAL_INDENT = "│   "
+_BLANK_INDENT = "    "
+
+# Upper bound on compiled pattern sets shared between processors
+_MATCHER_CACHE_SIZE = 256
+
+# frozenset(patterns) -> compiled matcher (None for an empty set), shared
+# by every processor and nested .gitignore scope
+_matcher_cache: Dict[frozenset, Optional[PatternMatcher]] = {}
+
+# Patterns of a nested .gitignore: (where paths relative to its directory
+# start within a root-relative path, include matcher, ignore matcher)
+GitignoreScope = Tuple[int, Optional[PatternMatcher], Optional[PatternMatcher]]
+
+
+def _shared_matcher(patterns: Iterable[str]) -> Optional[PatternMatcher]:
+    """Return the shared matcher for this pattern set, or None if it is empty"""
+    key = frozenset(patterns)
+    try:
+        return _matcher_cache[key]
+    except KeyError:
+        pass
+    
+    if len(_matcher_cache) >= _MATCHER_CACHE_SIZE:
+        _matcher_cache.clear()
+    matcher = _matcher_cache[key] = PatternMatcher(key) or None
+    return matcher
+
+
+class _PatternSet(set):
+    """Set of patterns that calls on_change whenever it is modified in place"""
+    
+    def __init__(self, patterns: Iterable[str], on_change):
+        super().__init__(patterns)
+        self._on_change = on_change
+    
+    def __reduce__(self):
+        # Copies and pickles are plain sets, detached from the processor
+        return set, (list(self),)
+    
+    def add(self, pattern):
+        super().add(pattern)
+        self._on_change()
+    
+    def discard(self, pattern):
+        super().discard(pattern)
+        self._on_change()
+    
+    def remove(self, pattern):
+        super().remove(pattern)
+        self._on_change()
+    
+    def pop(self):
+        pattern = super().pop()
+        self._on_change()
+        return pattern
+    
+    def clear(self):
+        super().clear()
+        self._on_change()
+    
+    def update(self, *others):
+        super().update(*others)
+        self._on_change()
+    
+    def difference_update(self, *others):
+        super().difference_update(*others)
+        self._on_change()
+    
+    def intersection_update(self, *others):
+        super().intersection_update(*others)
+        self._on_change()
+    
+    def symmetric_difference_update(self, other):
+        super().symmetric_difference_update(other)
+        self._on_change()
+    
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._on_change()
+        return result
+    
+    def __iand__(self, other):
+        result = super().__iand__(other)
+        self._on_change()
+        return result
+    
+    def __isub__(self, other):
+        result = super().__isub__(other)
+        self._on_change()
+        return result
+    
+    def __ixor__(self, other):
+        result = super().__ixor__(other)
+        self._on_change()
+        return result
+
+
+@dataclass(slots=True)
 class TreeNode:
     """Represents a node in the file tree"""
-    path: Path
+    path: str
     name: str
     is_dir: bool
     size: int = 0
-    children: List['TreeNode'] = None
+    children: List['TreeNode'] = field(default_factory=list)
     
-    def __post_init__(self):
-        if self.children is None:
-            self.children = []
+    def walk(self) -> Iterator['TreeNode']:
+        """Yield this node and all its descendants in display order"""
+        # Explicit stack so deep trees cost no recursion
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
 
 
 class TreeProcessor:
@@ -33,20 +151,63 @@ class TreeProcessor:
     
     def __init__(self, config: Config):
         self.config = config
+        self._config_root = config.get_root_path()
+        # Prefix stripped from entry paths to get paths relative to the root
+        self._root_prefix = os.path.join(str(self._config_root), '')
+        self._dir_color = COLORS['blue']
+        self._file_color = COLORS['white']
         self.ignore_patterns = set()
         self.include_patterns = set()
         self._load_ignore_patterns()
     
+    @property
+    def ignore_patterns(self) -> Set[str]:
+        """Active ignore patterns"""
+        return self._ignore_patterns
+    
+    @ignore_patterns.setter
+    def ignore_patterns(self, patterns: Iterable[str]):
+        self._ignore_patterns = _PatternSet(patterns, self._reset_matchers)
+        self._matchers = None
+    
+    @property
+    def include_patterns(self) -> Set[str]:
+        """Active force-include patterns"""
+        return self._include_patterns
+    
+    @include_patterns.setter
+    def include_patterns(self, patterns: Iterable[str]):
+        self._include_patterns = _PatternSet(patterns, self._reset_matchers)
+        self._matchers = None
+    
+    def _reset_matchers(self):
+        """Drop the compiled matchers after a pattern set changed in place"""
+        self._matchers = None
+    
+    def _get_matchers(self) -> Tuple[Optional[PatternMatcher], Optional[PatternMatcher]]:
+        """Return (include, ignore) matchers, None where there are no patterns"""
+        if self._matchers is None:
+            self._matchers = (_shared_matcher(self._include_patterns),
+                              _shared_matcher(self._ignore_patterns))
+        return self._matchers
+    
     def _load_ignore_patterns(self):
         """Load ignore patterns from .gitignore files"""
         if not self.config.respect_gitignore:
             return
         
-        root_path = self.config.get_root_path()
-        gitignore_files = find_gitignore_files(root_path)
+        gitignore_files = find_gitignore_files(self._config_root)
         
-        for gitignore_file in gitignore_files:
-            ignore_pats, include_pats = parse_gitignore(gitignore_file)
+        if len(gitignore_files) > 1:
+            # Each open() can be a round trip on network filesystems, so
+            # overlap the reads; a single file isn't worth starting threads for
+            workers = min(_GITIGNORE_READ_WORKERS, len(gitignore_files))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(parse_gitignore, gitignore_files))
+        else:
+            results = [parse_gitignore(gitignore_file) for gitignore_file in gitignore_files]
+        
+        for ignore_pats, include_pats in results:
             self.ignore_patterns.update(ignore_pats)
             self.include_patterns.update(include_pats)
         
@@ -54,120 +215,321 @@ class TreeProcessor:
         self.ignore_patterns.update(self.config.custom_ignore_patterns)
         self.include_patterns.update(self.config.force_include_patterns)
     
-    def should_ignore(self, path: Path, relative_path: str) -> bool:
-        """Check if path should be ignored"""
+    def should_ignore(self, path: Union[str, Path, os.DirEntry, None], relative_path: str,
+                      is_dir: Optional[bool] = None,
+                      scopes: Tuple[GitignoreScope, ...] = ()) -> bool:
+        """Check if path should be ignored, also applying nested .gitignore scopes"""
+        # path may be a DirEntry, a str, a Path, or None to use relative_path
+        if path is None:
+            name = relative_path.rpartition('/')[2]
+        elif isinstance(path, str):
+            name = os.path.basename(path)
+        else:
+            name = path.name
+        
         # Check if hidden and not showing hidden files
-        if not self.config.show_hidden and path.name.startswith('.'):
+        if not self.config.show_hidden and name.startswith('.'):
             return True
         
-        # Check include patterns first (they override ignore patterns)
-        for pattern in self.include_patterns:
-            if matches_pattern(relative_path, pattern, path.is_dir()):
-                return False
+        include_matcher, ignore_matcher = self._get_matchers()
+        
+        # Includes only ever un-ignore
+        if ignore_matcher is None and not scopes:
+            return False
+        
+        if is_dir is None:
+            if path is None:
+                is_dir = os.path.isdir(self._root_prefix + relative_path)
+            elif isinstance(path, str):
+                is_dir = os.path.isdir(path)
+            else:
+                is_dir = path.is_dir()
         
         # Check ignore patterns
-        for pattern in self.ignore_patterns:
-            if matches_pattern(relative_path, pattern, path.is_dir()):
-                return True
+        ignored = ignore_matcher is not None and ignore_matcher.match(relative_path, is_dir)
+        if not ignored:
+            for start, _, scope_ignore in scopes:
+                if scope_ignore is not None and scope_ignore.match(relative_path[start:], is_dir):
+                    ignored = True
+                    break
+        if not ignored:
+            return False
         
-        return False
+        # Include patterns override ignore patterns
+        if include_matcher is not None and include_matcher.match(relative_path, is_dir):
+            return False
+        for start, scope_include, _ in scopes:
+            if scope_include is not None and scope_include.match(relative_path[start:], is_dir):
+                return False
+        
+        return True
     
     def build_tree(self, root_path: Path, current_depth: int = 0) -> Optional[TreeNode]:
         """Build tree structure starting from root_path"""
-        if not root_path.exists():
-            return None
-        
         # Check depth limit
         if self.config.max_depth is not None and current_depth > self.config.max_depth:
             return None
         
-        # Create node
+        # A single stat answers exists/is_dir/is_file/size for the root
+        try:
+            root_stat = os.stat(root_path)
+        except OSError:
+            return None
+        
+        root_path = Path(root_path)
+        is_dir = stat.S_ISDIR(root_stat.st_mode)
         node = TreeNode(
-            path=root_path,
+            path=str(root_path),
             name=root_path.name,
-            is_dir=root_path.is_dir(),
-            size=get_file_size(root_path) if root_path.is_file() else 0
+            is_dir=is_dir,
+            size=root_stat.st_size if stat.S_ISREG(root_stat.st_mode) else 0
         )
         
         # If it's a directory, process children
-        if root_path.is_dir():
+        if is_dir:
+            self._scan_children(node, current_depth)
+        
+        return node
+    
+    def _scan_children(self, root: TreeNode, root_depth: int) -> None:
+        """Populate children for root and every directory beneath it"""
+        stack = [(root, root_depth, ())]
+        
+        # With jobs > 1, list the root itself, then hand each top-level
+        # directory to a worker
+        jobs = self.config.jobs
+        max_depth = self.config.max_depth
+        # The workers would have nothing to list when the depth limit stops
+        # at the top-level directories themselves
+        if jobs <= 1 or (max_depth is not None and root_depth + 2 > max_depth):
+            self._scan_stack(stack)
+            return
+        
+        self._scan_directory(*stack.pop(), stack)
+        if len(stack) > 1:
+            # Compile before the workers start
+            self._get_matchers()
+            # On any exception, Ctrl-C included, workers stop at their next
+            # directory and are not waited for
+            stop = threading.Event()
+            executor = ThreadPoolExecutor(max_workers=min(jobs, len(stack)))
             try:
-                children = []
-                config_root = self.config.get_root_path()
-                
-                for child_path in sorted(root_path.iterdir(), key=lambda p: (not p.is_dir(), p.name.lower())):
-                    # Calculate relative path from config root
-                    try:
-                        relative_path = str(child_path.relative_to(config_root))
-                    except ValueError:
-                        # If child_path is not relative to config_root, use name
-                        relative_path = child_path.name
-                    
-                    # Check if should ignore
-                    if self.should_ignore(child_path, relative_path):
-                        continue
-                    
-                    # Recursively process child
-                    child_node = self.build_tree(child_path, current_depth + 1)
-                    if child_node:
-                        children.append(child_node)
-                
-                node.children = children
+                futures = [executor.submit(self._scan_stack, [item], stop) for item in stack]
+                for future in futures:
+                    future.result()
+            except BaseException:
+                stop.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            executor.shutdown()
+        else:
+            self._scan_stack(stack)
+    
+    def _scan_stack(self, stack: List[Tuple[TreeNode, int, Tuple[GitignoreScope, ...]]],
+                    stop: Optional[threading.Event] = None) -> None:
+        """Scan directories from stack until it is empty or stop is set"""
+        scan_directory = self._scan_directory
+        while stack:
+            if stop is not None and stop.is_set():
+                return
+            node, current_depth, scopes = stack.pop()
+            scan_directory(node, current_depth, scopes, stack)
+    
+    def _scan_directory(self, node: TreeNode, current_depth: int, scopes: Tuple[GitignoreScope, ...],
+                        stack: List[Tuple[TreeNode, int, Tuple[GitignoreScope, ...]]]) -> None:
+        """List one directory into node.children, queueing its subdirectories"""
+        # Children past the depth limit would all be dropped, so don't list them
+        child_depth = current_depth + 1
+        max_depth = self.config.max_depth
+        if max_depth is not None and child_depth > max_depth:
+            return
+        
+        dir_fd = None
+        try:
+            if _SCANDIR_FD:
+                dir_fd = os.open(node.path, _DIR_OPEN_FLAGS)
+            with os.scandir(node.path if dir_fd is None else dir_fd) as it:
+                entries = [(entry.is_dir(follow_symlinks=False), entry) for entry in it]
+        except OSError:
+            # Can't read directory, leave children empty
+            if dir_fd is not None:
+                os.close(dir_fd)
+            return
+        
+        try:
+            node.children = self._make_children(node, entries, child_depth, scopes, stack)
+        finally:
+            # Entry stats go through dir_fd, so it stays open until they're done
+            if dir_fd is not None:
+                os.close(dir_fd)
+    
+    def _make_children(self, node: TreeNode, entries: List[Tuple[bool, os.DirEntry]],
+                       child_depth: int, scopes: Tuple[GitignoreScope, ...],
+                       stack: List[Tuple[TreeNode, int, Tuple[GitignoreScope, ...]]]) -> List[TreeNode]:
+        """Build the child nodes of node from its directory entries"""
+        entries.sort(key=lambda item: (not item[0], item[1].name.lower()))
+        
+        # Entries from an fd listing only carry their name, so paths are
+        # built from the parent's path; the relative part is shared per directory
+        dir_prefix = os.path.join(node.path, '')
+        root_prefix = self._root_prefix
+        if dir_prefix.startswith(root_prefix):
+            relative_prefix = dir_prefix[len(root_prefix):]
+        else:
+            # If directory is not under config_root, use names
+            relative_prefix = ''
+        
+        # The config root's .gitignore (and its ancestors') were loaded up
+        # front; any found below it only applies to its own subtree
+        if self.config.respect_gitignore and dir_prefix != root_prefix:
+            scopes = self._add_gitignore_scope(scopes, entries, dir_prefix, relative_prefix)
+        
+        # Ignored entries are dropped before any stat or descent
+        if not scopes and self._get_matchers()[1] is None:
+            # No ignore patterns (a clean checkout, or --no-gitignore), so
+            # only the hidden check can drop anything
+            if self.config.show_hidden:
+                kept = entries
+            else:
+                kept = [item for item in entries if not item[1].name.startswith('.')]
+        else:
+            should_ignore = self.should_ignore
+            kept = [
+                (is_dir, entry) for is_dir, entry in entries
+                if not should_ignore(entry, relative_prefix + entry.name, is_dir, scopes)
+            ]
+        
+        # Filled by index, as the final length is known
+        children = [None] * len(kept)
+        
+        for index, (is_dir, entry) in enumerate(kept):
+            name = entry.name
+            
+            if is_dir:
+                size = 0
+            else:
+                try:
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    size = 0
+            
+            child_node = TreeNode(
+                path=dir_prefix + name,
+                name=name,
+                is_dir=is_dir,
+                size=size
+            )
+            
+            # Queue child directories for their own listing
+            if is_dir:
+                stack.append((child_node, child_depth, scopes))
             
-            except PermissionError:
-                # Can't read directory, leave children empty
-                pass
+            children[index] = child_node
         
-        return node
+        return children
     
-    def format_tree(self, node: TreeNode, prefix: str = "", is_last: bool = True) -> List[str]:
-        lines = []
+    def _add_gitignore_scope(self, scopes: Tuple[GitignoreScope, ...],
+                             entries: List[Tuple[bool, os.DirEntry]],
+                             dir_prefix: str, relative_prefix: str) -> Tuple[GitignoreScope, ...]:
+        """Add the patterns of a directory's own .gitignore, if it has one"""
+        # The listing is already in hand, so finding the file costs no syscalls
+        if not any(entry.name == '.gitignore' and not is_dir for is_dir, entry in entries):
+            return scopes
         
-        connector = "└── " if is_last else "├── "
-        display_name = f"{connector}{node.name}/" if node.is_dir else f"{connector}{node.name}"
+        ignore_pats, include_pats = parse_gitignore(dir_prefix + '.gitignore')
+        include_matcher = _shared_matcher(include_pats)
+        ignore_matcher = _shared_matcher(ignore_pats)
+        if include_matcher is None and ignore_matcher is None:
+            return scopes
         
-        # Add icon if requested
-        if self.config.use_icons:
-            icon = get_file_icon(node.path)
-            display_name = f"{connector}{icon} {node.name}/" if node.is_dir else f"{connector}{icon} {node.name}"
-        
-        # Add size if requested
-        if self.config.show_size and not node.is_dir:
-            size_str = format_file_size(node.size)
-            display_name = f"{display_name} ({size_str})"
-        
-        # Color
-        if self.config.color_output:
-            if node.is_dir:
-                display_name = colorize_output(display_name, 'blue')
+        return scopes + ((len(relative_prefix), include_matcher, ignore_matcher),)
+    
+    def format_tree(self, node: TreeNode, prefix: str = "", is_last: bool = True) -> List[str]:
+        """Format node and its descendants as tree lines"""
+        return list(self.iter_tree_lines(node, prefix, is_last))
+    
+    def iter_tree_lines(self, node: TreeNode, prefix: str = "", is_last: bool = True) -> Iterator[str]:
+        """Yield formatted lines for node and its descendants"""
+        format_line = self._format_line
+        stack = [(node, prefix, is_last)]
+        
+        while stack:
+            node, prefix, is_last = stack.pop()
+            yield format_line(node, prefix, is_last)
+            
+            children = node.children
+            if not children:
+                continue
+            
+            child_prefix = prefix + (_BLANK_INDENT if is_last else _VERTICAL_INDENT)
+            last_index = len(children) - 1
+            
+            if any(child.children for child in children):
+                # Push children in reverse so they pop in display order
+                stack.extend(
+                    (children[i], child_prefix, i == last_index) for i in range(last_index, -1, -1)
+                )
             else:
-                display_name = colorize_output(display_name, 'white')
+                # Leaf-only directories are formatted directly
+                for i, child in enumerate(children):
+                    yield format_line(child, child_prefix, i == last_index)
+    
+    def _format_line(self, node: TreeNode, prefix: str, is_last: bool) -> str:
+        """Format the line for a single node"""
+        config = self.config
+        name = node.name
+        is_dir = node.is_dir
         
-        lines.append(f"{prefix}{display_name}")
+        # Each optional piece is an empty string when off
+        if is_dir:
+            suffix = "/"
+        elif config.show_size:
+            # Add size if requested
+            suffix = f" ({format_file_size(node.size)})"
+        else:
+            suffix = ""
         
-        # Process children
-        if node.children:
-            for i, child in enumerate(node.children):
-                is_child_last = (i == len(node.children) - 1)
-                child_prefix = prefix + ("    " if is_last else "│   ")
-                lines.extend(self.format_tree(child, child_prefix, is_child_last))
+        # Add icon if requested
+        icon = f"{get_file_icon(name, is_dir)} " if config.use_icons else ""
         
-        return lines
-
+        branch = _LAST_BRANCH if is_last else _MID_BRANCH
+        if config.color_output:
+            color = self._dir_color if is_dir else self._file_color
+            return f"{prefix}{color}{branch}{icon}{name}{suffix}{RESET}"
+        return f"{prefix}{branch}{icon}{name}{suffix}"
     
-    def generate_tree(self) -> List[str]:
-        """Generate formatted tree output"""
-        root_path = self.config.get_root_path()
+    def iter_tree(self) -> Iterator[str]:
+        """Build the tree for the configured root and yield its lines"""
+        root_path = self._config_root
         tree = self.build_tree(root_path)
         
         if not tree:
-            return [f"Error: Could not access {root_path}"]
+            yield f"Error: Could not access {root_path}"
+            return
+        
+        yield from self.iter_tree_lines(tree)
+    
+    def generate_tree(self) -> List[str]:
+        """Generate formatted tree output"""
+        return list(self.iter_tree())
+    
+    def write_tree(self, fp: TextIO, chunk_lines: int = 1024) -> None:
+        """Write tree output to fp as it is rendered, chunk_lines lines per write"""
+        batch = []
+        for line in self.iter_tree():
+            batch.append(line)
+            if len(batch) >= chunk_lines:
+                batch.append("")
+                fp.write("\n".join(batch))
+                batch.clear()
         
-        return self.format_tree(tree)
+        if batch:
+            batch.append("")
+            fp.write("\n".join(batch))
     
     def generate_json(self) -> Dict[str, Any]:
         """Generate JSON representation of tree"""
-        root_path = self.config.get_root_path()
+        root_path = self._config_root
         tree = self.build_tree(root_path)
         
         if not tree:
@@ -177,14 +539,24 @@ class TreeProcessor:
     
     def _node_to_dict(self, node: TreeNode) -> Dict[str, Any]:
         """Convert tree node to dictionary"""
-        result = {
+        result = self._node_fields(node)
+        
+        stack = [(node, result)]
+        while stack:
+            node, node_dict = stack.pop()
+            if node.children:
+                child_dicts = [self._node_fields(child) for child in node.children]
+                node_dict["children"] = child_dicts
+                stack.extend(zip(node.children, child_dicts))
+        
+        return result
+    
+    @staticmethod
+    def _node_fields(node: TreeNode) -> Dict[str, Any]:
+        """Get the dictionary fields of a single node, without children"""
+        return {
             "name": node.name,
             "path": str(node.path),
             "is_dir": node.is_dir,
             "size": node.size
-        }
-        
-        if node.children:
-            result["children"] = [self._node_to_dict(child) for child in node.children]
-        
-        return result
\ No newline at end of file
+        }
\ No newline at end of file
@@ -5,69 +5,348 @@ Utility functions for Bonsai
 """
 
 import fnmatch
+import functools
+import os
+import re
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 
-def find_gitignore_files(root_path: Path) -> List[Path]:
-    """Find all .gitignore files in the directory tree"""
+# Icons by lowercase file extension
+DIR_ICON = "📁"
+DEFAULT_FILE_ICON = "📄"
+ICON_MAP = {
+    '.py': '🐍',
+    '.js': '📜',
+    '.ts': '📘',
+    '.html': '🌐',
+    '.css': '🎨',
+    '.json': '📋',
+    '.md': '📝',
+    '.txt': '📄',
+    '.yml': '⚙️',
+    '.yaml': '⚙️',
+    '.xml': '📰',
+    '.png': '🖼️',
+    '.jpg': '🖼️',
+    '.jpeg': '🖼️',
+    '.gif': '🖼️',
+    '.svg': '🖼️',
+}
+
+# Extensions is_text_file can decide on without reading the file
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.py', '.js', '.ts', '.html', '.css', '.json',
+    '.xml', '.yml', '.yaml', '.ini', '.cfg', '.conf', '.log',
+    '.sql', '.sh', '.bat', '.ps1', '.c', '.cpp', '.h', '.hpp',
+    '.java', '.cs', '.php', '.rb', '.go', '.rs', '.swift', '.kt'
+}
+
+BINARY_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.webp', '.tiff',
+    '.mp3', '.wav', '.flac', '.ogg', '.mp4', '.mkv', '.avi', '.mov',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.tar', '.jar', '.whl',
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.exe', '.dll', '.so', '.dylib', '.o', '.a', '.lib', '.obj', '.bin',
+    '.pyc', '.pyo', '.class', '.wasm', '.sqlite', '.db',
+    '.woff', '.woff2', '.ttf', '.otf', '.eot'
+}
+
+TEXT_BY_EXTENSION = {
+    **dict.fromkeys(BINARY_EXTENSIONS, False),
+    **dict.fromkeys(TEXT_EXTENSIONS, True)
+}
+
+# ANSI escape codes
+RESET = '\033[0m'
+COLORS = {
+    'red': '\033[91m',
+    'green': '\033[92m',
+    'yellow': '\033[93m',
+    'blue': '\033[94m',
+    'magenta': '\033[95m',
+    'cyan': '\033[96m',
+    'white': '\033[97m',
+    'gray': '\033[90m',
+    'reset': RESET
+}
+
+
+def find_gitignore_files(root_path: Path, max_levels: Optional[int] = None) -> List[Path]:
+    """Find .gitignore files from root_path up to the directory containing .git"""
     gitignore_files = []
+    current_path = os.fspath(root_path)
+    levels = 0
     
-    for current_path in [root_path] + list(root_path.parents):
-        gitignore_path = current_path / ".gitignore"
-        if gitignore_path.exists():
-            gitignore_files.append(gitignore_path)
+    while True:
+        gitignore_path = os.path.join(current_path, ".gitignore")
+        if os.path.isfile(gitignore_path):
+            gitignore_files.append(Path(gitignore_path))
+        
+        # .git may be a directory or, for worktrees and submodules, a file
+        if os.path.exists(os.path.join(current_path, ".git")):
+            break
+        
+        levels += 1
+        if max_levels is not None and levels >= max_levels:
+            break
+        
+        parent_path = os.path.dirname(current_path)
+        if parent_path == current_path:
+            break
+        current_path = parent_path
     
     return gitignore_files
 
 
+# Upper bound on .gitignore files remembered by parse_gitignore
+_PARSE_CACHE_SIZE = 1024
+
+# str(path) -> (mtime_ns, size, ignore_patterns, include_patterns)
+_parse_cache: Dict[str, Tuple[int, int, Tuple[str, ...], Tuple[str, ...]]] = {}
+
+
 def parse_gitignore(gitignore_path: Path) -> Tuple[List[str], List[str]]:
     """Parse .gitignore file and return (ignore_patterns, include_patterns)"""
-    ignore_patterns = []
-    include_patterns = []
+    try:
+        st = os.stat(gitignore_path)
+    except OSError:
+        # Let the read below decide what an unreadable path means
+        return _read_gitignore(gitignore_path)
     
+    key = str(gitignore_path)
+    entry = _parse_cache.get(key)
+    if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+        return list(entry[2]), list(entry[3])
+    
+    ignore_patterns, include_patterns = _read_gitignore(gitignore_path)
+    
+    if len(_parse_cache) >= _PARSE_CACHE_SIZE:
+        _parse_cache.clear()
+    _parse_cache[key] = (st.st_mtime_ns, st.st_size,
+                         tuple(ignore_patterns), tuple(include_patterns))
+    
+    return ignore_patterns, include_patterns
+
+
+def _read_gitignore(gitignore_path: Path) -> Tuple[List[str], List[str]]:
+    """Read and parse a .gitignore file, bypassing the cache"""
     try:
+        # Text mode has already turned \r\n and \r into \n
         with open(gitignore_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                
-                # Skip empty lines and comments
-                if not line or line.startswith('#'):
-                    continue
-                
-                # Handle negation patterns
-                if line.startswith('!'):
-                    include_patterns.append(line[1:])
-                else:
-                    ignore_patterns.append(line)
+            text = f.read()
     
     except Exception:
         # Silently ignore errors reading .gitignore
-        pass
+        return [], []
+    
+    # Skip empty lines and comments
+    lines = [line for line in map(str.strip, text.split('\n')) if line and line[0] != '#']
+    
+    # Handle negation patterns
+    ignore_patterns = [line for line in lines if line[0] != '!']
+    include_patterns = [line[1:] for line in lines if line[0] == '!']
     
     return ignore_patterns, include_patterns
 
 
-def matches_pattern(path_str: str, pattern: str, is_dir: bool = False) -> bool:
-    """Check if path matches a gitignore pattern"""
+# Characters that make a gitignore pattern more than a literal name
+_GLOB_CHARS = re.compile(r'[*?\[]')
+
+# Whether os.path.normcase folds case here (Windows), as fnmatch.fnmatch
+# does to both the name and the pattern
+_FOLD_CASE = os.path.normcase('A') == 'a'
+
+# Upper bound on memoized path components per PatternMatcher regex
+_PART_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_glob(pattern: str) -> Tuple[bool, bool, Callable[[str], Optional[re.Match]]]:
+    """Split a gitignore pattern into (dir_only, anchored, match)"""
     # Handle directory patterns
-    if pattern.endswith('/'):
-        if not is_dir:
-            return False
+    dir_only = pattern.endswith('/')
+    if dir_only:
         pattern = pattern[:-1]
     
-    # Handle absolute patterns (starting with /)
+    # Handle absolute patterns (starting with /) and patterns with path separators
     if pattern.startswith('/'):
         pattern = pattern[1:]
-        return fnmatch.fnmatch(path_str, pattern)
+        anchored = True
+    else:
+        anchored = '/' in pattern
     
-    # Handle patterns with path separators
-    if '/' in pattern:
-        return fnmatch.fnmatch(path_str, pattern)
+    # Same normalisation fnmatch.fnmatch applies to both sides
+    regex = re.compile(fnmatch.translate(os.path.normcase(pattern)))
+    return dir_only, anchored, regex.match
+
+
+def matches_pattern(path_str: str, pattern: str, is_dir: bool = False) -> bool:
+    """Check if path matches a gitignore pattern"""
+    dir_only, anchored, match = _compile_glob(pattern)
+    
+    if dir_only and not is_dir:
+        return False
+    
+    normcase = os.path.normcase
+    if anchored:
+        return match(normcase(path_str)) is not None
     
     # Match against any part of the path
-    path_parts = path_str.split('/')
-    return any(fnmatch.fnmatch(part, pattern) for part in path_parts)
+    return any(match(normcase(part)) is not None for part in path_str.split('/'))
+
+
+class PatternMatcher:
+    """Set of gitignore patterns that matches what matches_pattern would for each"""
+    
+    def __init__(self, patterns: Iterable[str] = ()):
+        # Keyed by (dir_only, anchored)
+        groups = {key: [] for key in ((False, False), (False, True), (True, False), (True, True))}
+        literals = {key: set() for key in groups}
+        prefixes = {key: set() for key in groups}
+        
+        for pattern in patterns:
+            if _FOLD_CASE:
+                pattern = pattern.lower()
+            
+            dir_only = pattern.endswith('/')
+            if dir_only:
+                pattern = pattern[:-1]
+            
+            if pattern.startswith('/'):
+                key = (dir_only, True)
+                pattern = pattern[1:]
+            else:
+                key = (dir_only, '/' in pattern)
+            
+            stem = pattern.rstrip('*')
+            if (key[1] and 0 < len(pattern) - len(stem) <= 2 and stem[-1:] == '/'
+                    and len(stem) > 1 and not _GLOB_CHARS.search(stem)):
+                # dir/* and dir/** match everything below dir, since
+                # fnmatch's * also matches '/'; with no * at all (dir//)
+                # the pattern is not a prefix
+                prefixes[key].add(stem)
+            elif _GLOB_CHARS.search(pattern):
+                groups[key].append(pattern)
+            else:
+                # fnmatch treats everything else literally, so a match is equality
+                literals[key].add(pattern)
+        
+        self._any_anchored, self._any_anchored_by_root = self._compile_anchored(groups[False, True])
+        self._any_parts = self._compile(groups[False, False])
+        self._dir_anchored, self._dir_anchored_by_root = self._compile_anchored(groups[True, True])
+        self._dir_parts = self._compile(groups[True, False])
+        
+        self._any_anchored_literals = frozenset(literals[False, True])
+        self._any_part_literals = frozenset(literals[False, False])
+        self._dir_anchored_literals = frozenset(literals[True, True])
+        self._dir_part_literals = frozenset(literals[True, False])
+        
+        # Tuples, as str.startswith takes them
+        self._any_anchored_prefixes = tuple(sorted(prefixes[False, True]))
+        self._dir_anchored_prefixes = tuple(sorted(prefixes[True, True]))
+        
+        # Component -> matched, for the two per-component regexes
+        self._any_part_hits = {}
+        self._dir_part_hits = {}
+    
+    @staticmethod
+    def _compile(patterns: List[str]) -> Optional[re.Pattern]:
+        """Join translated globs into one alternation, or None if empty"""
+        if not patterns:
+            return None
+        return re.compile('|'.join(fnmatch.translate(p) for p in patterns))
+    
+    @classmethod
+    def _compile_anchored(cls, patterns: List[str]) -> Tuple[Optional[re.Pattern], Dict[str, re.Pattern]]:
+        """Compile anchored globs by first path component, plus one for wildcard roots"""
+        wild = []
+        by_root = {}
+        for pattern in patterns:
+            root, sep, _ = pattern.partition('/')
+            if sep and not _GLOB_CHARS.search(root):
+                by_root.setdefault(root, []).append(pattern)
+            else:
+                wild.append(pattern)
+        
+        return cls._compile(wild), {root: cls._compile(group) for root, group in by_root.items()}
+    
+    def __bool__(self) -> bool:
+        return any((
+            self._any_anchored, self._any_parts, self._dir_anchored, self._dir_parts,
+            self._any_anchored_by_root, self._dir_anchored_by_root,
+            self._any_anchored_literals, self._any_part_literals,
+            self._dir_anchored_literals, self._dir_part_literals,
+            self._any_anchored_prefixes, self._dir_anchored_prefixes
+        ))
+    
+    def match(self, path_str: str, is_dir: bool = False) -> bool:
+        """Check if path matches any of the compiled patterns"""
+        if _FOLD_CASE:
+            path_str = path_str.lower()
+        
+        if self._any_anchored_by_root or self._dir_anchored_by_root:
+            root = path_str.partition('/')[0]
+        else:
+            root = None
+        
+        # Directory-only patterns are the usual reason a directory is
+        # ignored, so try them first; files skip them entirely
+        if is_dir:
+            if path_str in self._dir_anchored_literals:
+                return True
+            if self._dir_anchored_prefixes and path_str.startswith(self._dir_anchored_prefixes):
+                return True
+            if self._dir_anchored and self._dir_anchored.match(path_str):
+                return True
+            rooted = self._dir_anchored_by_root.get(root)
+            if rooted and rooted.match(path_str):
+                return True
+        
+        if path_str in self._any_anchored_literals:
+            return True
+        if self._any_anchored_prefixes and path_str.startswith(self._any_anchored_prefixes):
+            return True
+        if self._any_anchored and self._any_anchored.match(path_str):
+            return True
+        rooted = self._any_anchored_by_root.get(root)
+        if rooted and rooted.match(path_str):
+            return True
+        
+        if is_dir:
+            dir_parts, dir_part_literals = self._dir_parts, self._dir_part_literals
+        else:
+            dir_parts, dir_part_literals = None, None
+        any_parts, any_part_literals = self._any_parts, self._any_part_literals
+        
+        if not (dir_parts or dir_part_literals or any_parts or any_part_literals):
+            return False
+        
+        parts = path_str.split('/')
+        if dir_part_literals and not dir_part_literals.isdisjoint(parts):
+            return True
+        if any_part_literals and not any_part_literals.isdisjoint(parts):
+            return True
+        
+        if dir_parts and self._match_parts(dir_parts, self._dir_part_hits, parts):
+            return True
+        if any_parts and self._match_parts(any_parts, self._any_part_hits, parts):
+            return True
+        
+        return False
+    
+    @staticmethod
+    def _match_parts(regex: re.Pattern, hits: Dict[str, bool], parts: List[str]) -> bool:
+        """Check if any path component matches regex, memoizing per component"""
+        for part in parts:
+            hit = hits.get(part)
+            if hit is None:
+                if len(hits) >= _PART_CACHE_SIZE:
+                    hits.clear()
+                hit = hits[part] = regex.match(part) is not None
+            if hit:
+                return True
+        return False
 
 
 def get_file_size(path: Path) -> int:
@@ -78,93 +357,96 @@ def get_file_size(path: Path) -> int:
         return 0
 
 
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+
+@functools.lru_cache(maxsize=4096)
 def format_file_size(size: int) -> str:
     """Format file size in human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size < 1024.0:
-            return f"{size:.1f}{unit}"
-        size /= 1024.0
-    return f"{size:.1f}PB"
+    if size < 1024:
+        return f"{size:.1f}B"
+    
+    # Each unit is 2**10 of the previous one
+    if isinstance(size, int):
+        shift = min((size.bit_length() - 1) // 10, 5)
+    else:
+        # Floats and other numbers have no bit length
+        shift = 0
+        while shift < 5 and size >= 1 << ((shift + 1) * 10):
+            shift += 1
+    return f"{size / (1 << (shift * 10)):.1f}{SIZE_UNITS[shift]}"
 
 
-def get_file_icon(path: Path) -> str:
+# Path separators, which a bare file name never contains
+_SEPARATORS = frozenset(os.sep + (os.altsep or ''))
+
+
+def get_file_icon(path: Union[str, Path], is_dir: Optional[bool] = None) -> str:
     """Get icon for file based on extension"""
-    if path.is_dir():
-        return "📁"
-    
-    extension = path.suffix.lower()
-    icon_map = {
-        '.py': '🐍',
-        '.js': '📜',
-        '.ts': '📘',
-        '.html': '🌐',
-        '.css': '🎨',
-        '.json': '📋',
-        '.md': '📝',
-        '.txt': '📄',
-        '.yml': '⚙️',
-        '.yaml': '⚙️',
-        '.xml': '📰',
-        '.png': '🖼️',
-        '.jpg': '🖼️',
-        '.jpeg': '🖼️',
-        '.gif': '🖼️',
-        '.svg': '🖼️',
-    }
-    
-    return icon_map.get(extension, '📄')
+    if is_dir is None:
+        is_dir = Path(path).is_dir()
+    
+    if is_dir:
+        return DIR_ICON
+    
+    # The tree passes bare names, which don't need splitext's handling of
+    # directories in the path
+    if isinstance(path, str) and _SEPARATORS.isdisjoint(path):
+        extension = _name_extension(path).lower()
+    else:
+        extension = os.path.splitext(path)[1].lower()
+    return ICON_MAP.get(extension, DEFAULT_FILE_ICON)
+
+
+def _name_extension(name: str) -> str:
+    """Return os.path.splitext(name)[1] for a name without separators"""
+    stem, dot, extension = name.rpartition('.')
+    # Leading dots start a hidden name, not an extension
+    if not dot or not stem.strip('.'):
+        return ''
+    return dot + extension
 
 
 def is_text_file(path: Path) -> bool:
     """Check if file is likely a text file"""
+    # Check by extension first, which needs no filesystem access at all
+    is_text = TEXT_BY_EXTENSION.get(path.suffix.lower())
+    if is_text is not None:
+        return is_text
+    
     if not path.is_file():
         return False
     
-    # Check by extension first
-    text_extensions = {
-        '.txt', '.md', '.py', '.js', '.ts', '.html', '.css', '.json',
-        '.xml', '.yml', '.yaml', '.ini', '.cfg', '.conf', '.log',
-        '.sql', '.sh', '.bat', '.ps1', '.c', '.cpp', '.h', '.hpp',
-        '.java', '.cs', '.php', '.rb', '.go', '.rs', '.swift', '.kt'
-    }
+    # Check by reading first few bytes
+    try:
+        chunk = _read_head(path, 1024)
+    except Exception:
+        return False
     
-    if path.suffix.lower() in text_extensions:
+    if not chunk:
         return True
     
-    # Check by reading first few bytes
-    try:
-        with open(path, 'rb') as f:
-            chunk = f.read(1024)
-            if not chunk:
-                return True
-            
-            # Check for null bytes (binary indicator)
-            if b'\x00' in chunk:
-                return False
-            
-            # Try to decode as UTF-8
-            try:
-                chunk.decode('utf-8')
-                return True
-            except UnicodeDecodeError:
-                return False
+    # Check for null bytes (binary indicator)
+    if b'\x00' in chunk:
+        return False
     
-    except Exception:
+    # Try to decode as UTF-8
+    try:
+        chunk.decode('utf-8')
+        return True
+    except UnicodeDecodeError:
         return False
 
 
+def _read_head(path: Path, size: int) -> bytes:
+    """Read up to size bytes from the start of a file"""
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+
 def colorize_output(text: str, color: str) -> str:
     """Add ANSI color codes to text"""
-    colors = {
-        'red': '\033[91m',
-        'green': '\033[92m',
-        'yellow': '\033[93m',
-        'blue': '\033[94m',
-        'magenta': '\033[95m',
-        'cyan': '\033[96m',
-        'white': '\033[97m',
-        'gray': '\033[90m',
-        'reset': '\033[0m'
-    }
-    
-    return f"{colors.get(color, '')}{text}{colors['reset']}"
+    return f"{COLORS.get(color, '')}{text}{RESET}"
@@ -6,9 +6,12 @@ Tests for Git integration functionality in Bonsai
 import pytest
 from pathlib import Path
 from unittest.mock import patch, mock_open
+import shutil
 import tempfile
 
-from bonsai.utils import find_gitignore_files, parse_gitignore, matches_pattern
+from bonsai.utils import (
+    find_gitignore_files, parse_gitignore, matches_pattern, PatternMatcher
+)
 from bonsai.config import Config
 from bonsai.processor import TreeProcessor
 
@@ -68,6 +71,59 @@ class TestGitIntegration:
             assert gitignore_c in gitignore_files
             assert gitignore_a in gitignore_files
     
+    def test_find_gitignore_stops_at_repo_root(self):
+        """Test .gitignore files above the repository root are not used"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            
+            # .gitignore outside the repository
+            (temp_path / ".gitignore").write_text("*\n")
+            
+            repo_path = temp_path / "repo"
+            src_dir = repo_path / "src"
+            src_dir.mkdir(parents=True)
+            (repo_path / ".git").mkdir()
+            
+            repo_gitignore = repo_path / ".gitignore"
+            repo_gitignore.write_text("*.log\n")
+            
+            gitignore_files = find_gitignore_files(src_dir)
+            
+            assert gitignore_files == [repo_gitignore]
+    
+    def test_find_gitignore_max_levels(self):
+        """Test limiting how many directories are searched"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            
+            deep_dir = temp_path / "a" / "b"
+            deep_dir.mkdir(parents=True)
+            
+            (temp_path / ".gitignore").write_text("*.log\n")
+            b_gitignore = deep_dir / ".gitignore"
+            b_gitignore.write_text("*.tmp\n")
+            
+            # Only a/b and a are searched
+            assert find_gitignore_files(deep_dir, max_levels=2) == [b_gitignore]
+    
+    def test_parse_gitignore_reuses_unchanged_file(self):
+        """Test an unchanged .gitignore is only read once per process"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            gitignore = Path(temp_dir) / ".gitignore"
+            gitignore.write_text("*.log\n!keep.log\n")
+            
+            assert parse_gitignore(gitignore) == (["*.log"], ["keep.log"])
+            with patch("builtins.open") as mock_file:
+                ignore_patterns, _ = parse_gitignore(gitignore)
+            mock_file.assert_not_called()
+            
+            # Callers get their own lists
+            ignore_patterns.append("*.tmp")
+            assert parse_gitignore(gitignore) == (["*.log"], ["keep.log"])
+            
+            gitignore.write_text("*.tmp\n")
+            assert parse_gitignore(gitignore) == (["*.tmp"], [])
+    
     def test_common_gitignore_patterns(self):
         """Test common .gitignore patterns used in real projects"""
         common_patterns = [
@@ -282,15 +338,7 @@ __pycache__/
             tree = processor.build_tree(temp_path)
             
             # Get all paths in the tree
-            def collect_paths(node, paths=None):
-                if paths is None:
-                    paths = []
-                paths.append(node.name)
-                for child in node.children:
-                    collect_paths(child, paths)
-                return paths
-            
-            all_paths = collect_paths(tree)
+            all_paths = [node.name for node in tree.walk()]
             
             # Should not include ignored directories
             assert "node_modules" not in all_paths
@@ -373,12 +421,7 @@ __pycache__/
             assert "custom" not in child_names
             
             # Check that temp.log is not in any child files
-            def has_file(node, filename):
-                if node.name == filename:
-                    return True
-                return any(has_file(child, filename) for child in node.children)
-            
-            assert not has_file(tree, "temp.log")
+            assert not any(node.name == "temp.log" for node in tree.walk())
     
     def test_gitignore_force_include_override(self):
         """Test that force include patterns override .gitignore"""
@@ -453,6 +496,122 @@ __pycache__/
             assert processor.should_ignore(Path("debug.log"), "debug.log")
             assert processor.should_ignore(Path("src/module/test.tmp"), "src/module/test.tmp")
             assert processor.should_ignore(Path("src/module/debug.log"), "src/module/debug.log")
+    
+    def test_ancestor_gitignores_all_loaded(self):
+        """Test every .gitignore above the root is loaded when read concurrently"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            (temp_path / ".git").mkdir()
+            
+            current = temp_path
+            for level in range(5):
+                (current / ".gitignore").write_text(f"*.level{level}\n!keep{level}\n")
+                current = current / f"d{level}"
+                current.mkdir()
+            
+            processor = TreeProcessor(Config(root_path=str(current)))
+            
+            for level in range(5):
+                assert f"*.level{level}" in processor.ignore_patterns
+                assert f"keep{level}" in processor.include_patterns
+    
+    def test_nested_gitignore_scoped_to_directory(self):
+        """Test a .gitignore below the root only applies to its own subtree"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            (temp_path / ".git").mkdir()
+            (temp_path / ".gitignore").write_text("*.tmp\n")
+            
+            src_dir = temp_path / "src"
+            (src_dir / "pkg").mkdir(parents=True)
+            (src_dir / ".gitignore").write_text("*.log\n/local.cfg\n!keep.tmp\n")
+            
+            for name in ("debug.log", "local.cfg", "a.tmp"):
+                (temp_path / name).write_text("x")
+            for name in ("debug.log", "local.cfg", "a.tmp", "keep.tmp", "main.py"):
+                (src_dir / name).write_text("x")
+            for name in ("debug.log", "local.cfg"):
+                (src_dir / "pkg" / name).write_text("x")
+            
+            processor = TreeProcessor(Config(root_path=str(temp_path)))
+            tree = processor.generate_json()
+            
+            def names(node):
+                return {child["name"] for child in node.get("children", [])}
+            
+            src = next(c for c in tree["children"] if c["name"] == "src")
+            pkg = next(c for c in src["children"] if c["name"] == "pkg")
+            
+            # Root is unaffected by src/.gitignore
+            assert names(tree) == {"src", "debug.log", "local.cfg"}
+            # Anchored patterns are relative to src/, negation re-includes
+            assert names(src) == {"pkg", "keep.tmp", "main.py"}
+            assert names(pkg) == {"local.cfg"}
+            
+            # Nested files are skipped entirely without gitignore support
+            processor = TreeProcessor(Config(root_path=str(temp_path), respect_gitignore=False))
+            src = next(c for c in processor.generate_json()["children"] if c["name"] == "src")
+            assert "debug.log" in names(src)
+    
+    def test_nested_gitignore_goes_through_should_ignore(self):
+        """Test the same rules apply with and without a nested .gitignore"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            (temp_path / ".git").mkdir()
+            
+            (temp_path / "src").mkdir()
+            (temp_path / "src" / ".gitignore").write_text("*.tmp\n")
+            (temp_path / "lib").mkdir()
+            for directory in ("src", "lib"):
+                for name in (".env", "debug.log", "important.log", "a.tmp", "main.py"):
+                    (temp_path / directory / name).write_text("x")
+            
+            config = Config(
+                root_path=str(temp_path),
+                custom_ignore_patterns=["*.log"],
+                force_include_patterns=["important.log"]
+            )
+            processor = TreeProcessor(config)
+            with patch.object(processor, "should_ignore", wraps=processor.should_ignore) as mock_ignore:
+                tree = processor.build_tree(temp_path)
+            
+            children = {node.name: {child.name for child in node.children} for node in tree.children}
+            # Hidden files, ignores and force-includes behave the same in both
+            assert children["lib"] == {"important.log", "a.tmp", "main.py"}
+            assert children["src"] == {"important.log", "main.py"}
+            
+            # Both directories are decided by should_ignore, src with its scope
+            scopes = {call.args[1]: call.args[3] for call in mock_ignore.call_args_list}
+            assert len(scopes["src/debug.log"]) == 1
+            assert scopes["lib/debug.log"] == ()
+    
+    def test_identical_nested_gitignores_share_matcher(self):
+        """Test identical pattern sets are compiled once, across processors too"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            (temp_path / ".git").mkdir()
+            
+            for pkg in ("a", "b", "c"):
+                pkg_dir = temp_path / "packages" / pkg
+                pkg_dir.mkdir(parents=True)
+                (pkg_dir / ".gitignore").write_text("dist/\n*.log\n")
+                (pkg_dir / "dist").mkdir()
+                (pkg_dir / "build.log").touch()
+                (pkg_dir / "index.js").touch()
+            
+            with patch.dict("bonsai.processor._matcher_cache", clear=True), \
+                    patch("bonsai.processor.PatternMatcher", wraps=PatternMatcher) as mock_matcher:
+                for _ in range(2):
+                    processor = TreeProcessor(Config(root_path=str(temp_path)))
+                    tree = processor.build_tree(temp_path)
+                    
+                    names = {node.name for node in tree.walk()}
+                    assert "index.js" in names
+                    assert "dist" not in names and "build.log" not in names
+            
+            # The empty set and the packages' shared set, once each
+            compiled = [call.args[0] for call in mock_matcher.call_args_list]
+            assert sorted(compiled, key=len) == [frozenset(), frozenset({"dist/", "*.log"})]
 
 
 class TestGitignoreEdgeCases:
@@ -687,61 +846,66 @@ class TestGitignorePerformance:
 
 
 # Fixtures for Git integration tests
-@pytest.fixture
-def git_repo_structure():
-    """Create a realistic Git repository structure for testing"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = Path(temp_dir)
-        
-        # Create .git directory
-        git_dir = temp_path / ".git"
-        git_dir.mkdir()
-        (git_dir / "config").write_text("[core]\nrepositoryformatversion = 0")
-        
-        # Create typical project structure
-        directories = [
-            "src",
-            "tests",
-            "docs",
-            "build",
-            "dist",
-            "node_modules/package",
-            ".vscode",
-            "logs",
-            "__pycache__"
-        ]
-        
-        for dir_path in directories:
-            (temp_path / dir_path).mkdir(parents=True)
-        
-        # Create typical files
-        files = [
-            "README.md",
-            "package.json",
-            "requirements.txt",
-            "setup.py",
-            ".env",
-            ".env.example",
-            "src/main.py",
-            "src/config.py",
-            "tests/test_main.py",
-            "docs/api.md",
-            "build/output.js",
-            "dist/bundle.js",
-            "node_modules/package/index.js",
-            ".vscode/settings.json",
-            "logs/debug.log",
-            "logs/error.log",
-            "__pycache__/main.cpython-39.pyc"
-        ]
-        
-        for file_path in files:
-            file_obj = temp_path / file_path
-            file_obj.parent.mkdir(parents=True, exist_ok=True)
+@pytest.fixture(scope="session")
+def git_repo_template(tmp_path_factory):
+    """Build the realistic Git repository layout once per test session"""
+    temp_path = tmp_path_factory.mktemp("git_repo_template")
+    
+    # Create .git directory
+    git_dir = temp_path / ".git"
+    git_dir.mkdir()
+    (git_dir / "config").write_text("[core]\nrepositoryformatversion = 0")
+    
+    # Create typical project structure
+    directories = [
+        "src",
+        "tests",
+        "docs",
+        "build",
+        "dist",
+        "node_modules/package",
+        ".vscode",
+        "logs",
+        "__pycache__"
+    ]
+    
+    for dir_path in directories:
+        (temp_path / dir_path).mkdir(parents=True)
+    
+    # Create typical files
+    files = [
+        "README.md",
+        "package.json",
+        "requirements.txt",
+        "setup.py",
+        ".env",
+        ".env.example",
+        "src/main.py",
+        "src/config.py",
+        "tests/test_main.py",
+        "docs/api.md",
+        "build/output.js",
+        "dist/bundle.js",
+        "node_modules/package/index.js",
+        ".vscode/settings.json",
+        "logs/debug.log",
+        "logs/error.log",
+        "__pycache__/main.cpython-39.pyc"
+    ]
+    
+    # Only the env files' contents are meaningful; the rest just need to exist
+    content_files = {".env", ".env.example"}
+    
+    for file_path in files:
+        file_obj = temp_path / file_path
+        file_obj.parent.mkdir(parents=True, exist_ok=True)
+        if file_path in content_files:
             file_obj.write_text(f"Content of {file_path}")
-        
-        # Create comprehensive .gitignore
-        gitignore_content = """
+        else:
+            file_obj.touch()
+    
+    # Create comprehensive .gitignore
+    gitignore_content = """
 # Byte-compiled / optimized / DLL files
 __pycache__/
 *.py[cod]
@@ -814,10 +978,19 @@ yarn-error.log*
 !.env.example
 !logs/important.log
 """
-        
-        (temp_path / ".gitignore").write_text(gitignore_content)
-        
-        yield temp_path
+    
+    (temp_path / ".gitignore").write_text(gitignore_content)
+    
+    return temp_path
+
+
+@pytest.fixture
+def git_repo_structure(git_repo_template, tmp_path):
+    """Create a realistic Git repository structure for testing"""
+    # Tests rewrite .gitignore, so each one gets its own copy of the template
+    repo_path = tmp_path / "repo"
+    shutil.copytree(git_repo_template, repo_path, symlinks=True)
+    return repo_path
 
 
 @pytest.fixture
@@ -890,15 +1063,7 @@ class TestRealWorldScenarios:
         tree = processor.build_tree(repo_path)
         
         # Collect all paths
-        def collect_all_paths(node, paths=None):
-            if paths is None:
-                paths = []
-            paths.append(node.name)
-            for child in node.children:
-                collect_all_paths(child, paths)
-            return paths
-        
-        all_paths = collect_all_paths(tree)
+        all_paths = [node.name for node in tree.walk()]
         
         # Should exclude Python-specific ignored items
         assert "__pycache__" not in all_paths
@@ -956,15 +1121,7 @@ Thumbs.db
         processor = TreeProcessor(config)
         tree = processor.build_tree(repo_path)
         
-        def collect_all_paths(node, paths=None):
-            if paths is None:
-                paths = []
-            paths.append(node.name)
-            for child in node.children:
-                collect_all_paths(child, paths)
-            return paths
-        
-        all_paths = collect_all_paths(tree)
+        all_paths = [node.name for node in tree.walk()]
         
         # Should exclude both Python and Node.js artifacts
         assert "__pycache__" not in all_paths
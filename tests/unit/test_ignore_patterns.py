@@ -3,13 +3,14 @@
 Tests for ignore pattern functionality in Bonsai
 """
 
+import os
 import pytest
 from pathlib import Path
 from unittest.mock import Mock, patch, mock_open
 import tempfile
 
 from bonsai.utils import (
-    find_gitignore_files, parse_gitignore, matches_pattern,
+    find_gitignore_files, parse_gitignore, matches_pattern, _compile_glob, PatternMatcher,
     get_file_size, format_file_size, get_file_icon, is_text_file
 )
 from bonsai.config import Config
@@ -49,6 +50,159 @@ class TestIgnorePatterns:
         assert matches_pattern("src/node_modules/package", "node_modules", True)
         assert matches_pattern("deep/nested/temp/file.txt", "temp", True)
         assert matches_pattern("project/build/output.js", "build", True)
+    
+    def test_matches_pattern_compiles_once(self):
+        """Test repeated matches reuse the compiled pattern"""
+        _compile_glob.cache_clear()
+        
+        for name in ("a.log", "b.log", "c.txt"):
+            matches_pattern(name, "*.log", False)
+        
+        info = _compile_glob.cache_info()
+        assert info.misses == 1
+        assert info.hits == 2
+
+
+class TestPatternMatcher:
+    """Test compiled pattern matching"""
+    
+    def test_matcher_agrees_with_matches_pattern(self):
+        """Test compiled matcher gives the same answers as matches_pattern"""
+        patterns = ["*.log", "build/", "/config.json", "src/*.py", "node_modules", "temp/*"]
+        paths = [
+            "debug.log", "logs/debug.log", "build", "src/build", "config.json",
+            "src/config.json", "src/main.py", "node_modules/package", "temp/cache.txt",
+            "README.md"
+        ]
+        matcher = PatternMatcher(patterns)
+        
+        for path in paths:
+            for is_dir in (False, True):
+                expected = any(matches_pattern(path, p, is_dir) for p in patterns)
+                assert matcher.match(path, is_dir) == expected, f"{path} (dir={is_dir})"
+    
+    def test_matcher_agrees_for_common_pattern_shapes(self):
+        """Test literal, suffix, prefix and residual glob shapes all agree"""
+        patterns = [
+            "Makefile", "*.py", "**/*.pyc", "src/**", "docs/*", "/vendor/*", "out/**/",
+            "src/**/*.py", "tmp?/", "[ab].txt", "build//", "/dist//"
+        ]
+        paths = [
+            "Makefile", "lib/Makefile", "main.py", "lib/util.py", "lib/util.pyc", "src",
+            "src/a.txt", "src/pkg/mod.py", "docs/index.md", "docs", "vendor/lib.js",
+            "lib/vendor/x.js", "out/bin", "out", "tmp1", "cache/tmp2", "a.txt", "c.txt",
+            "lib/b.txt", "build", "build/", "build/out.o", "dist/app.js"
+        ]
+        matcher = PatternMatcher(patterns)
+        
+        # Directory prefixes skip the regex
+        assert matcher._any_anchored_prefixes == ("docs/", "src/", "vendor/")
+        assert matcher._dir_anchored_prefixes == ("out/",)
+        # Anchored globs are only tried on paths under their first component
+        assert list(matcher._any_anchored_by_root) == ["src"]
+        
+        for path in paths:
+            for is_dir in (False, True):
+                expected = any(matches_pattern(path, p, is_dir) for p in patterns)
+                assert matcher.match(path, is_dir) == expected, f"{path} (dir={is_dir})"
+    
+    def test_matcher_agrees_when_case_is_folded(self):
+        """Test both matchers fold case together where normcase does"""
+        patterns = ["*.LOG", "Build/", "/Config.json", "src/*.PY", "Docs/**"]
+        paths = ["debug.log", "Debug.Log", "build", "BUILD", "config.JSON", "SRC/main.py",
+                 "docs/index.md", "README.md"]
+        
+        _compile_glob.cache_clear()
+        try:
+            with patch("bonsai.utils._FOLD_CASE", True), patch("os.path.normcase", str.lower):
+                matcher = PatternMatcher(patterns)
+                assert matcher.match("Debug.Log")
+                assert matcher.match("SRC/main.py")
+                
+                for path in paths:
+                    for is_dir in (False, True):
+                        expected = any(matches_pattern(path, p, is_dir) for p in patterns)
+                        assert matcher.match(path, is_dir) == expected, f"{path} (dir={is_dir})"
+        finally:
+            _compile_glob.cache_clear()
+    
+    def test_literal_patterns(self):
+        """Test wildcard-free patterns match whole path components only"""
+        patterns = [f"file{i}.txt" for i in range(20000)] + ["node_modules/", "/dist", ".DS_Store"]
+        matcher = PatternMatcher(patterns)
+        
+        assert matcher.match("file19999.txt")
+        assert matcher.match("deep/dir/file42.txt")
+        assert not matcher.match("file42.txt.bak")
+        assert matcher.match("web/node_modules", True)
+        assert not matcher.match("web/node_modules", False)
+        assert matcher.match("dist")
+        assert not matcher.match("web/dist")
+        assert matcher.match("photos/.DS_Store")
+    
+    def test_pathological_globs_do_not_backtrack(self):
+        """Test star-heavy globs stay fast on long non-matching names"""
+        # Exponential with a naive .* translation; fnmatch's atomic groups
+        # keep this to a few microseconds
+        pattern = "*a" * 12 + "*b"
+        matcher = PatternMatcher([pattern, "dir/" + pattern])
+        
+        assert not matcher.match("a" * 200)
+        assert not matcher.match("dir/" + "a" * 200)
+        assert not matches_pattern("a" * 200, pattern)
+    
+    def test_component_memo_is_bounded(self):
+        """Test memoized component matches stay correct when the memo is full"""
+        matcher = PatternMatcher(["*.log", "tmp?/"])
+        
+        with patch('bonsai.utils._PART_CACHE_SIZE', 4):
+            for i in range(20):
+                assert matcher.match(f"dir{i}/file{i}.log")
+                assert not matcher.match(f"dir{i}/file{i}.txt")
+                assert matcher.match(f"dir{i}/tmp1", True)
+        
+            assert len(matcher._any_part_hits) <= 4
+            assert len(matcher._dir_part_hits) <= 4
+    
+    def test_empty_matcher(self):
+        """Test matcher with no patterns matches nothing"""
+        matcher = PatternMatcher([])
+        
+        assert not matcher
+        assert not matcher.match("anything.txt")
+        assert not matcher.match("anything", True)
+    
+    def test_reassigning_patterns_recompiles(self):
+        """Test replacing processor patterns takes effect immediately"""
+        config = Config(respect_gitignore=False)
+        processor = TreeProcessor(config)
+        
+        assert not processor.should_ignore(Path("debug.log"), "debug.log", False)
+        
+        processor.ignore_patterns = {"*.log"}
+        assert processor.should_ignore(Path("debug.log"), "debug.log", False)
+        
+        processor.include_patterns = {"debug.log"}
+        assert not processor.should_ignore(Path("debug.log"), "debug.log", False)
+    
+    def test_changing_patterns_in_place_recompiles(self):
+        """Test adding to or removing from processor patterns takes effect immediately"""
+        config = Config(respect_gitignore=False)
+        processor = TreeProcessor(config)
+        
+        assert not processor.should_ignore(Path("a.xyz"), "a.xyz", is_dir=False)
+        
+        processor.ignore_patterns.add("*.xyz")
+        assert processor.should_ignore(Path("a.xyz"), "a.xyz", is_dir=False)
+        
+        processor.include_patterns |= {"a.xyz"}
+        assert not processor.should_ignore(Path("a.xyz"), "a.xyz", is_dir=False)
+        
+        processor.include_patterns.clear()
+        assert processor.should_ignore(Path("a.xyz"), "a.xyz", is_dir=False)
+        
+        processor.ignore_patterns.discard("*.xyz")
+        assert not processor.should_ignore(Path("a.xyz"), "a.xyz", is_dir=False)
 
 
 class TestGitignoreParser:
@@ -167,6 +321,67 @@ class TestTreeProcessor:
         # Should not ignore important.log due to force include
         assert not processor.should_ignore(Path("important.log"), "important.log")
     
+    def test_should_ignore_str_paths(self, tmp_path):
+        """Test should_ignore works from strings without building a Path"""
+        (tmp_path / "build").mkdir()
+        (tmp_path / "notes").write_text("x")
+        
+        config = Config(root_path=str(tmp_path), respect_gitignore=False)
+        processor = TreeProcessor(config)
+        processor.ignore_patterns = {"build/", "notes/"}
+        
+        # Hidden check uses the last component of relative_path
+        assert processor.should_ignore(None, "src/.env")
+        
+        # Directory-ness is looked up under the root when not given
+        assert processor.should_ignore(None, "build")
+        assert not processor.should_ignore(None, "notes")
+        assert processor.should_ignore(str(tmp_path / "build"), "build")
+        assert not processor.should_ignore(str(tmp_path / "notes"), "notes")
+    
+    def test_include_patterns_only_checked_for_ignored_paths(self):
+        """Test includes are only consulted once an ignore pattern matched"""
+        config = Config(respect_gitignore=False)
+        processor = TreeProcessor(config)
+        processor.ignore_patterns = {"*.log"}
+        processor.include_patterns = {"keep.log"}
+        include_matcher, _ = processor._get_matchers()
+        
+        with patch.object(include_matcher, 'match', wraps=include_matcher.match) as mock_match:
+            assert not processor.should_ignore(Path("main.py"), "main.py", False)
+            assert mock_match.call_count == 0
+            
+            assert processor.should_ignore(Path("debug.log"), "debug.log", False)
+            assert not processor.should_ignore(Path("keep.log"), "keep.log", False)
+            assert mock_match.call_count == 2
+    
+    def test_should_ignore_without_ignore_patterns(self):
+        """Test includes alone never cause a directory check"""
+        config = Config(respect_gitignore=False)
+        processor = TreeProcessor(config)
+        processor.include_patterns = {"*.log"}
+        
+        with patch('pathlib.Path.is_dir') as mock_is_dir:
+            assert not processor.should_ignore(Path("debug.txt"), "debug.txt")
+        
+        mock_is_dir.assert_not_called()
+    
+    def test_build_tree_without_ignore_patterns(self):
+        """Test listings with no ignore patterns skip should_ignore"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            (temp_path / ".env").touch()
+            (temp_path / "main.py").touch()
+            
+            for show_hidden, expected in ((False, ["main.py"]), (True, [".env", "main.py"])):
+                processor = TreeProcessor(Config(root_path=temp_dir, respect_gitignore=False,
+                                                 show_hidden=show_hidden))
+                with patch.object(processor, 'should_ignore') as mock_should_ignore:
+                    tree = processor.build_tree(temp_path)
+                
+                assert [child.name for child in tree.children] == expected
+                mock_should_ignore.assert_not_called()
+    
     @patch('bonsai.utils.find_gitignore_files')
     @patch('bonsai.utils.parse_gitignore')
     def test_load_ignore_patterns_from_gitignore(self, mock_parse, mock_find):
@@ -205,6 +420,15 @@ class TestUtilityFunctions:
         with patch.object(Path, 'is_dir', return_value=True):
             assert get_file_icon(Path("folder")) == "📁"
     
+    def test_get_file_icon_by_name(self):
+        """Test bare names get the same icons as paths"""
+        names = ["main.py", "README.MD", ".py", "..py", ".hidden.py", "archive.tar.js", "py", "a.", "dir.py/file"]
+        for name in names:
+            assert get_file_icon(name, False) == get_file_icon(Path(name), False), name
+        
+        assert get_file_icon(".py", False) == "📄"
+        assert get_file_icon("docs.md/notes", False) == "📄"
+    
     def test_format_file_size(self):
         """Test file size formatting"""
         assert format_file_size(0) == "0.0B"
@@ -214,6 +438,14 @@ class TestUtilityFunctions:
         assert format_file_size(500) == "500.0B"
         assert format_file_size(1536) == "1.5KB"
     
+    def test_format_file_size_float(self):
+        """Test file size formatting accepts floats, as the division loop did"""
+        assert format_file_size(1536.0) == "1.5KB"
+        assert format_file_size(512.5) == "512.5B"
+        assert format_file_size(3.5 * 1024 ** 3) == "3.5GB"
+        assert format_file_size(2.0 * 1024 ** 6) == "2048.0PB"
+        assert format_file_size(float("inf")) == "infPB"
+    
     def test_get_file_size(self):
         """Test getting file size"""
         with patch.object(Path, 'stat') as mock_stat:
@@ -241,13 +473,32 @@ class TestUtilityFunctions:
         # Mock a file that doesn't have a text extension
         with patch.object(Path, 'is_file', return_value=True):
             with patch.object(Path, 'suffix', ".unknown"):
-                with patch("builtins.open", mock_open(read_data=b"Hello World")):
+                with patch("bonsai.utils._read_head", return_value=b"Hello World"):
                     assert is_text_file(Path("test.unknown"))
                 
                 # Test binary content
-                with patch("builtins.open", mock_open(read_data=b"\x00\x01\x02")):
+                with patch("bonsai.utils._read_head", return_value=b"\x00\x01\x02"):
                     assert not is_text_file(Path("test.unknown"))
     
+    def test_is_text_file_reads_real_files(self, tmp_path):
+        """Test content sniffing on files on disk"""
+        (tmp_path / "notes").write_bytes("caf\u00e9\n".encode("utf-8"))
+        (tmp_path / "blob").write_bytes(b"\x7fELF\x00\x01")
+        (tmp_path / "empty").touch()
+        
+        assert is_text_file(tmp_path / "notes")
+        assert not is_text_file(tmp_path / "blob")
+        assert is_text_file(tmp_path / "empty")
+        assert not is_text_file(tmp_path / "missing")
+    
+    def test_is_text_file_binary_extension(self):
+        """Test known binary extensions are rejected without opening the file"""
+        with patch("bonsai.utils._read_head") as mock_read:
+            assert not is_text_file(Path("image.png"))
+            assert not is_text_file(Path("module.PYC"))
+        
+        mock_read.assert_not_called()
+    
     def test_find_gitignore_files(self):
         """Test finding .gitignore files in directory hierarchy"""
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -435,6 +686,64 @@ class TestIntegration:
             if child.is_dir:
                 assert len(child.children) == 0
     
+    def test_max_depth_prunes_directory_listing(self, temp_project_dir):
+        """Test directories at the depth limit are never listed"""
+        config = Config(
+            root_path=str(temp_project_dir),
+            max_depth=1,
+            respect_gitignore=False
+        )
+        processor = TreeProcessor(config)
+        
+        with patch('os.scandir', wraps=os.scandir) as mock_scandir:
+            processor.build_tree(temp_project_dir)
+        
+        # Only the root is listed; its subdirectories sit at the limit
+        assert mock_scandir.call_count == 1
+    
+    def test_ignored_directory_not_listed(self, temp_project_dir):
+        """Test ignored directories are pruned before being listed"""
+        config = Config(
+            root_path=str(temp_project_dir),
+            respect_gitignore=True
+        )
+        processor = TreeProcessor(config)
+        
+        with patch('bonsai.processor._SCANDIR_FD', False), \
+             patch('os.scandir', wraps=os.scandir) as mock_scandir:
+            processor.build_tree(temp_project_dir)
+        
+        listed = [str(call.args[0]) for call in mock_scandir.call_args_list]
+        assert str(temp_project_dir / "build") not in listed
+        assert str(temp_project_dir / "src") in listed
+    
+    def test_build_tree_single_file(self, temp_project_dir):
+        """Test building a tree rooted at a file uses its stat size"""
+        config = Config(root_path=str(temp_project_dir))
+        processor = TreeProcessor(config)
+        
+        node = processor.build_tree(temp_project_dir / "README.md")
+        
+        assert node is not None
+        assert node.name == "README.md"
+        assert node.is_dir is False
+        assert node.size == len("# Test Project")
+        assert node.children == []
+    
+    def test_fd_listing_matches_path_listing(self, temp_project_dir):
+        """Test listing directories through fds builds the same tree"""
+        config = Config(
+            root_path=str(temp_project_dir),
+            respect_gitignore=True
+        )
+        processor = TreeProcessor(config)
+        
+        with_fd = processor.generate_json()
+        with patch('bonsai.processor._SCANDIR_FD', False):
+            without_fd = processor.generate_json()
+        
+        assert with_fd == without_fd
+    
     def test_tree_formatting(self, temp_project_dir):
         """Test tree formatting output"""
         config = Config(
@@ -3,10 +3,16 @@
 Tests for header insertion and file content features in Bonsai
 """
 
+import io
+import stat
+import sys
+import tempfile
+import time
 import pytest
 from pathlib import Path
-from unittest.mock import Mock, patch, mock_open
+from unittest.mock import Mock, patch
 
+from bonsai.cli import create_parser
 from bonsai.config import Config
 from bonsai.processor import TreeProcessor, TreeNode
 from bonsai.utils import is_text_file, get_file_size, format_file_size, colorize_output
@@ -74,6 +80,26 @@ class TestHeaderInsertion:
         assert len(parent.children) == 2
         assert parent.children[0].name == "file1.txt"
         assert parent.children[1].name == "file2.txt"
+    
+    def test_tree_node_walk(self):
+        """Test walking a node yields the whole tree in display order"""
+        root = TreeNode(path=Path("/r"), name="r", is_dir=True)
+        src = TreeNode(path=Path("/r/src"), name="src", is_dir=True)
+        src.children = [TreeNode(path=Path("/r/src/main.py"), name="main.py", is_dir=False)]
+        root.children = [src, TreeNode(path=Path("/r/README.md"), name="README.md", is_dir=False)]
+        
+        assert [node.name for node in root.walk()] == ["r", "src", "main.py", "README.md"]
+        assert next(node for node in root.walk() if not node.is_dir).name == "main.py"
+    
+    def test_tree_node_children_not_shared(self):
+        """Test each TreeNode gets its own children list"""
+        first = TreeNode(path=Path("/a"), name="a", is_dir=True)
+        second = TreeNode(path=Path("/b"), name="b", is_dir=True)
+        
+        first.children.append(second)
+        
+        assert second.children == []
+        assert not hasattr(first, "__dict__")
 
 
 class TestTreeFormatting:
@@ -289,6 +315,28 @@ class TestTreeFormatting:
         assert "level0" in tree_content
         assert "level4" in tree_content
     
+    def test_write_tree_streams_lines(self):
+        """Test write_tree writes the same lines generate_tree returns"""
+        root = TreeNode(
+            path=Path("/project"),
+            name="project",
+            is_dir=True
+        )
+        root.children = [
+            TreeNode(path=Path(f"/project/file{i}.txt"), name=f"file{i}.txt", is_dir=False)
+            for i in range(5)
+        ]
+        
+        config = Config(color_output=False)
+        processor = TreeProcessor(config)
+        
+        buffer = io.StringIO()
+        with patch.object(processor, 'build_tree', return_value=root):
+            lines = processor.generate_tree()
+            processor.write_tree(buffer, chunk_lines=2)
+        
+        assert buffer.getvalue() == "\n".join(lines) + "\n"
+    
     def test_format_tree_empty_directory(self):
         """Test formatting of empty directory"""
         root = TreeNode(
@@ -319,6 +367,13 @@ class TestUtilityFunctions:
         assert format_file_size(1073741824) == "1.0GB"
         assert format_file_size(1099511627776) == "1.0TB"
     
+    def test_format_file_size_unit_boundaries(self):
+        """Test sizes just below a unit stay in the smaller unit"""
+        assert format_file_size(1023) == "1023.0B"
+        assert format_file_size(1024 * 1024 - 1) == "1024.0KB"
+        assert format_file_size(1024 ** 5) == "1.0PB"
+        assert format_file_size(1024 ** 6) == "1024.0PB"
+    
     def test_colorize_output(self):
         """Test output colorization"""
         colored = colorize_output("test", "red")
@@ -331,8 +386,8 @@ class TestUtilityFunctions:
         assert "test" in colored_unknown
         assert "\033[0m" in colored_unknown
     
-    @patch('builtins.open', new_callable=mock_open, read_data=b'Hello World')
-    def test_is_text_file_by_extension(self, mock_file):
+    @patch('bonsai.utils._read_head', return_value=b'Hello World')
+    def test_is_text_file_by_extension(self, mock_read):
         """Test text file detection by extension"""
         assert is_text_file(Path("test.txt")) is True
         assert is_text_file(Path("test.py")) is True
@@ -340,15 +395,15 @@ class TestUtilityFunctions:
         assert is_text_file(Path("test.md")) is True
         assert is_text_file(Path("test.json")) is True
     
-    @patch('builtins.open', new_callable=mock_open, read_data=b'\x00\x01\x02')
-    def test_is_text_file_binary(self, mock_file):
+    @patch('bonsai.utils._read_head', return_value=b'\x00\x01\x02')
+    def test_is_text_file_binary(self, mock_read):
         """Test binary file detection"""
         # Mock Path.is_file to return True
         with patch.object(Path, 'is_file', return_value=True):
             assert is_text_file(Path("test.unknown")) is False
     
-    @patch('builtins.open', new_callable=mock_open, read_data=b'Valid UTF-8 text')
-    def test_is_text_file_utf8(self, mock_file):
+    @patch('bonsai.utils._read_head', return_value=b'Valid UTF-8 text')
+    def test_is_text_file_utf8(self, mock_read):
         """Test UTF-8 text file detection"""
         # Mock Path.is_file to return True and suffix to return unknown
         with patch.object(Path, 'is_file', return_value=True), \
@@ -378,6 +433,15 @@ class TestConfigFunctionality:
         assert config.force_include_patterns == []
         assert config.output_file is None
         assert config.output_format == "tree"
+        assert config.jobs == 1
+    
+    def test_config_slots(self):
+        """Test Config rejects unknown settings instead of storing them"""
+        config = Config()
+        
+        assert not hasattr(config, "__dict__")
+        with pytest.raises(AttributeError):
+            config.show_hiden = True
     
     def test_config_from_args(self):
         """Test config creation from command line arguments"""
@@ -394,6 +458,7 @@ class TestConfigFunctionality:
         args.include = ["important.log"]
         args.output = "output.txt"
         args.format = "json"
+        args.jobs = 4
         
         config = Config.from_args(args)
         
@@ -408,6 +473,18 @@ class TestConfigFunctionality:
         assert config.force_include_patterns == ["important.log"]
         assert config.output_file == "output.txt"
         assert config.output_format == "json"
+        assert config.jobs == 4
+    
+    def test_jobs_argument_must_be_positive(self):
+        """Test --jobs rejects values below 1"""
+        parser = create_parser()
+        
+        assert parser.parse_args(["-j", "4"]).jobs == 4
+        assert parser.parse_args([]).jobs == 1
+        
+        for value in ("0", "-2", "many"):
+            with pytest.raises(SystemExit):
+                parser.parse_args(["--jobs", value])
     
     def test_config_get_root_path(self):
         """Test root path resolution"""
@@ -417,6 +494,14 @@ class TestConfigFunctionality:
         assert isinstance(root_path, Path)
         assert root_path.is_absolute()
     
+    def test_config_get_root_path_follows_reassignment(self):
+        """Test root path reflects a reassigned root_path"""
+        config = Config(root_path="/test/path")
+        assert config.get_root_path() == Path("/test/path").resolve()
+        
+        config.root_path = "/other/path"
+        assert config.get_root_path() == Path("/other/path").resolve()
+    
     def test_config_should_show_file_hidden(self):
         """Test hidden file visibility logic"""
         config = Config(show_hidden=False)
@@ -497,20 +582,21 @@ class TestTreeProcessor:
         assert node.size == 1024
         assert node.children == []
     
-    @patch('pathlib.Path.exists', return_value=True)
-    @patch('pathlib.Path.is_dir', return_value=True)
-    @patch('pathlib.Path.is_file', return_value=False)
-    def test_build_tree_directory(self, mock_is_file, mock_is_dir, mock_exists):
+    @patch('os.stat', return_value=Mock(st_mode=stat.S_IFDIR, st_size=0))
+    def test_build_tree_directory(self, mock_stat):
         """Test building tree for a directory"""
         config = Config()
         processor = TreeProcessor(config)
         
         dir_path = Path("/test/dir")
         
-        # Mock iterdir to return empty list (empty directory)
-        with patch.object(Path, 'iterdir', return_value=[]):
+        # Mock scandir to return an empty listing (empty directory); with
+        # fd listing on, os.open would fail on the fake path before scandir
+        with patch('bonsai.processor._SCANDIR_FD', False), patch('os.scandir') as mock_scandir:
+            mock_scandir.return_value.__enter__.return_value = iter([])
             node = processor.build_tree(dir_path)
         
+        mock_scandir.assert_called_once_with(str(dir_path))
         assert node is not None
         assert node.name == "dir"
         assert node.is_dir is True
@@ -533,7 +619,7 @@ class TestTreeProcessor:
         
         nonexistent_path = Path("/nonexistent/path")
         
-        with patch.object(Path, 'exists', return_value=False):
+        with patch('os.stat', side_effect=FileNotFoundError()):
             node = processor.build_tree(nonexistent_path)
         
         assert node is None
@@ -583,6 +669,108 @@ class TestTreeProcessor:
         
         assert isinstance(json_output, dict)
         assert "error" in json_output
+    
+    def test_generate_json_deep_tree(self):
+        """Test JSON output for trees deeper than the recursion limit"""
+        root = TreeNode(path=Path("/d"), name="d", is_dir=True)
+        node = root
+        for _ in range(sys.getrecursionlimit() + 100):
+            child = TreeNode(path=Path("/d/d"), name="d", is_dir=True)
+            node.children = [child]
+            node = child
+        
+        config = Config()
+        processor = TreeProcessor(config)
+        
+        with patch.object(processor, 'build_tree', return_value=root):
+            json_output = processor.generate_json()
+        
+        depth = 0
+        while "children" in json_output:
+            json_output = json_output["children"][0]
+            depth += 1
+        assert depth == sys.getrecursionlimit() + 100
+    
+    def test_generate_tree_deep_tree(self):
+        """Test tree output for trees deeper than the recursion limit"""
+        depth = sys.getrecursionlimit() + 100
+        root = TreeNode(path=Path("/d"), name="d", is_dir=True)
+        node = root
+        for _ in range(depth):
+            child = TreeNode(path=Path("/d/d"), name="d", is_dir=True)
+            node.children = [child]
+            node = child
+        
+        config = Config(color_output=False)
+        processor = TreeProcessor(config)
+        
+        with patch.object(processor, 'build_tree', return_value=root):
+            lines = processor.generate_tree()
+        
+        assert len(lines) == depth + 1
+        assert lines[-1] == "    " * depth + "└── d/"
+    
+    def test_build_tree_with_jobs(self):
+        """Test threaded listing builds the same tree as the serial walk"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            (temp_path / ".gitignore").write_text("*.log\n")
+            for pkg in ("a", "b", "c"):
+                (temp_path / pkg / "src").mkdir(parents=True)
+                (temp_path / pkg / "src" / "main.py").touch()
+                (temp_path / pkg / "debug.log").touch()
+            (temp_path / "README.md").touch()
+            
+            def shape(jobs, max_depth=None):
+                config = Config(root_path=temp_dir, jobs=jobs, max_depth=max_depth)
+                tree = TreeProcessor(config).build_tree(temp_path)
+                return [(node.path, node.is_dir) for node in tree.walk()]
+            
+            assert shape(4) == shape(1)
+            assert shape(4, max_depth=1) == shape(1, max_depth=1)
+            assert not any(path.endswith(".log") for path, _ in shape(4))
+            
+            # Too shallow for the workers to have anything to list
+            with patch("bonsai.processor.ThreadPoolExecutor") as mock_executor:
+                shape(4, max_depth=1)
+            mock_executor.assert_not_called()
+    
+    def test_build_tree_with_jobs_interrupted(self):
+        """Test an interrupt stops the other workers instead of waiting for them"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            (temp_path / "a").mkdir()
+            deep = temp_path / "b"
+            for level in range(50):
+                deep = deep / str(level)
+            deep.mkdir(parents=True)
+            
+            processor = TreeProcessor(Config(root_path=temp_dir, jobs=2))
+            scan_directory = processor._scan_directory
+            listed = []
+            
+            def slow_scan(node, current_depth, scopes, stack):
+                if node.name == "a":
+                    time.sleep(0.1)
+                    raise KeyboardInterrupt
+                if node.path.startswith(str(temp_path / "b")):
+                    listed.append(node.path)
+                    time.sleep(0.02)
+                scan_directory(node, current_depth, scopes, stack)
+            
+            start = time.monotonic()
+            with patch.object(processor, "_scan_directory", side_effect=slow_scan):
+                with pytest.raises(KeyboardInterrupt):
+                    processor.build_tree(temp_path)
+            
+                # The walk of b would take a second; it is abandoned instead
+                assert time.monotonic() - start < 0.5
+                time.sleep(0.1)
+                stopped_at = len(listed)
+                time.sleep(0.1)
+            
+            assert stopped_at == len(listed)
+            assert 0 < stopped_at < 51
 
 
 class TestGitignoreHandling:
@@ -637,17 +825,36 @@ class TestErrorHandling:
         processor = TreeProcessor(config)
         
         # Mock a directory that raises PermissionError
-        with patch('pathlib.Path.exists', return_value=True), \
-             patch('pathlib.Path.is_dir', return_value=True), \
-             patch('pathlib.Path.iterdir', side_effect=PermissionError("Access denied")):
+        with patch('os.stat', return_value=Mock(st_mode=stat.S_IFDIR, st_size=0)), \
+             patch('bonsai.processor._SCANDIR_FD', False), \
+             patch('os.scandir', side_effect=PermissionError("Access denied")) as mock_scandir:
             
             node = processor.build_tree(Path("/restricted"))
         
+        mock_scandir.assert_called_once_with("/restricted")
+        
         # Should create node but with empty children
         assert node is not None
         assert node.is_dir is True
         assert node.children == []
     
+    def test_permission_error_opening_directory(self):
+        """Test handling of permission errors when opening a directory to list it"""
+        config = Config()
+        processor = TreeProcessor(config)
+        
+        with patch('os.stat', return_value=Mock(st_mode=stat.S_IFDIR, st_size=0)), \
+             patch('bonsai.processor._SCANDIR_FD', True), \
+             patch('os.open', side_effect=PermissionError("Access denied")) as mock_open_dir, \
+             patch('os.scandir') as mock_scandir:
+            
+            node = processor.build_tree(Path("/restricted"))
+        
+        mock_open_dir.assert_called_once()
+        mock_scandir.assert_not_called()
+        assert node is not None
+        assert node.children == []
+    
     def test_file_size_error_handling(self):
         """Test handling of file size errors"""
         with patch('pathlib.Path.stat', side_effect=OSError("File not found")):